@@ -1,4 +1,6 @@
 import os
+import glob
+import shutil
 import json
 import csv
 from itertools import chain
@@ -10,6 +12,8 @@ import gensim
 import networkx as nx
 import matplotlib.pyplot as plt
 
+from network import DocumentNetwork
+
 def extract_links(fulltext):
     if fulltext is not pd.np.nan:
         doc = nlp_en(" ".join(fulltext))
@@ -36,19 +40,21 @@ def clean_link(link, url2title):
         name, ext = os.path.splitext(tail)
     return name
 
-def plotGraph(G, figsize=(8, 8), filename=None):
+def plotGraph(G, figsize=(8, 8), filename=None, centrality=None):
     """
     Plots an individual graph, node size by degree centrality,
     edge size by edge weight.
+    Precomputed centralities can be passed as a dictionary.
     """
     labels = {n:n for n in G.nodes()}
 
-    try:
-        # for networks with only one node
-        d = nx.degree_centrality(G)
-        nodesize = [v * 250 for v in d.values()]
-    except:
-        nodesize = [1 * 250 for n in G.nodes()]
+    if centrality is None:
+        try:
+            # for networks with only one node
+            centrality = nx.degree_centrality(G)
+        except:
+            centrality = {}
+    nodesize = [centrality.get(n, 1) * 250 for n in G.nodes()]
 
     layout=nx.layout.fruchterman_reingold_layout
     pos=layout(G)
@@ -79,24 +85,143 @@ def plotGraph(G, figsize=(8, 8), filename=None):
     plt.close("all")
 
 
-def plot_component_subgraphs(B):
-    subgraphs = list(nx.components.connected_component_subgraphs(B, False))
-    subgraphs = sorted(subgraphs, key = len, reverse=True)
-    for i, sg in enumerate(subgraphs[:1]):
-        plotGraph(sg, (24, 24), os.path.join(output, str(i)+".svg"))
-    for i, sg in enumerate(subgraphs[1:10]):
-        plotGraph(sg, (8, 8), os.path.join(output, str(i+1)+".svg"))
+def plot_component_subgraphs(B, output, network=None):
+    if network is None:
+        network = DocumentNetwork(B)
+    components = network.components()
+    for i, nodes in enumerate(components[:10]):
+        figsize = (24, 24) if i == 0 else (8, 8)
+        plotGraph(B.subgraph(nodes), figsize, os.path.join(output, str(i)+".svg"),
+                  network.degree_centrality(nodes))
+
+
+def export_graph(B, output, name, network=None):
+    """
+    Write the graph as GraphML, with PageRank as node attribute,
+    and as compact binary edge list next to the document projection.
+    """
+    if network is None:
+        network = DocumentNetwork(B)
+    for node, rank in network.pagerank().items():
+        B.add_node(node, pagerank=rank)
+    nx.write_graphml(B, os.path.join(output, "%s.graphml" %name))
+    network.write_edgelist(os.path.join(output, "%s.edges.npz" %name))
+    network.write_projection(os.path.join(output, "%s.projection.npz" %name))
+
+
+def listify(series):
+    """Wrap all values of a series that are not lists into a list."""
+    return series.map(lambda x: x if type(x) == list else [x])
+
+def unlistify(series):
+    """Join all list values of a series into a single string."""
+    return series.map(lambda x: " ".join(x) if type(x) == list else x)
+
+def iter_chunks(input, chunksize):
+    """Read a corpus.json in DataFrames of at most chunksize documents."""
+    with open(input, "r") as infile:
+        records = []
+        for line in infile:
+            if not line.strip():
+                continue
+            records.append(json.loads(line))
+            if len(records) == chunksize:
+                yield pd.DataFrame(records)
+                records = []
+        if records:
+            yield pd.DataFrame(records)
+
+def iter_parts(partsfolder):
+    """Read the DataFrames written by MassoCorpus.preprocess_chunked() one at a time."""
+    for part in sorted(glob.glob(os.path.join(partsfolder, "part-*.pkl"))):
+        yield pd.read_pickle(part)
+
+def get_mentionables(df):
+    """Return the lowercased titles and the identifiers of a DataFrame."""
+    titles = [t.lower() for t in unlistify(df['title']).tolist()]
+    identifiers = [str(j) for j in list(chain.from_iterable([i for i in df['identifier'].tolist() if i is not pd.np.nan]))]
+    return titles, identifiers
+
+def collect_mentionables(input):
+    """Stream a corpus.json and return the titles and identifiers of all documents.
+
+    Only the title and identifier fields are kept in memory.
+    """
+    titles, identifiers = [], []
+    with open(input, "r") as infile:
+        for line in infile:
+            if not line.strip():
+                continue
+            doc = json.loads(line)
+            title = doc.get('title')
+            if type(title) == list:
+                title = " ".join(title)
+            titles.append(title.lower())
+            if doc.get('identifier'):
+                identifiers.extend(str(i) for i in doc.get('identifier'))
+    return titles, identifiers
+
+def preprocess_df(df, titles, identifiers, url2title, title2url):
+    """Run the per-document preprocessing steps on a DataFrame.
+
+    Mentions are searched for in the given titles and identifiers,
+    which may cover more documents than df itself.
+    """
+    if 'links' not in df:
+        # batches of PDFs only have no links column
+        df['links'] = [[] for _ in range(len(df))]
+    df['fulltext'] = listify(df['fulltext'])
+    df['links'] = listify(df['links'])
+    df['title'] = unlistify(df['title'])
+    df['links2'] = df['fulltext'].map(extract_links)
+    df['entities'] = df['fulltext'].map(extract_entities)
+    df['title_mentions'] = df['fulltext'].map(lambda x: find_entities(x, titles))
+    df['identifier_mentions'] = df['fulltext'].map(lambda x: find_entities(x, identifiers))
+    df['links'] = df[['links', 'links2']].apply(lambda x: list(chain.from_iterable(x)), axis=1)
+    df['links'] = df['links'].map(lambda x: [i for i in x if i is not pd.np.nan])
+    df['links'] = df['links'].map(lambda x: [l for l in x if "@" not in l]) # filter out email addresses
+    df['cites'] = df['links'].map(lambda x: [clean_link(l, url2title) for l in x])
+    df['targets'] = df[['cites', 'title_mentions']].apply(lambda x: list(chain.from_iterable(x)), axis=1)
+    df['target_links'] = df['targets'].map(lambda x: [title2url.get(t) for t in x if title2url.get(t)])
+    return df
+
+def add_edges(B, labels, df):
+    """Add the documents of df and their targets to the graph B."""
+    for title, targets in zip(df['title'], df['targets']):
+        source = title
+        targets = [t for t in targets if len(t) > 1]
+        if source not in B:
+            B.add_node(source, bipartite=0)
+            labels[source] = source
+        for target in targets:
+            if target not in B:
+                B.add_node(target, bipartite=1)
+            B.add_edge(source, target)
 
 
 nlp_en = spacy.load('en')
 
 
 class MassoCorpus(object):
-    """docstring for MassoCorpus"""
-    def __init__(self, input, output, cached_df=None):
+    """Corpus of extracted documents, preprocessed into a DataFrame.
+
+    With a chunksize, corpus.json is not loaded at once, instead
+    preprocess_chunked() processes it in batches of chunksize documents.
+
+    Args:
+        input (str): relative or absolute path of the corpus.json
+        output (str): relative or absolute path of the results folder
+        cached_df (str): relative or absolute path of a cached DataFrame
+        chunksize (int): number of documents per batch in chunked mode
+    """
+    def __init__(self, input, output, cached_df=None, chunksize=None):
         super(MassoCorpus, self).__init__()
+        self.input = input
+        self.chunksize = chunksize
         if cached_df:
             self.df = self.load_cached_df(cached_df)
+        elif chunksize:
+            self.df = None
         else:
             self.df = pd.read_json(input, lines=True)
         self.output = output
@@ -104,26 +229,43 @@ class MassoCorpus(object):
         self.title2url = self.get_title2url()
 
     def preprocess(self):
-        self.listify_colum('fulltext')
-        self.listify_colum('links')
-        self.unlistify_colum('title')
-        self.df['links2'] = self.df['fulltext'].map(extract_links)
-        self.df['entities'] = self.df['fulltext'].map(extract_entities)
-        titles = [t.lower() for t in self.df['title'].tolist()]
-        self.df['title_mentions'] = self.df['fulltext'].map(lambda x: find_entities(x, titles))
-        identifiers = [str(j) for j in list(chain.from_iterable([i for i in self.df['identifier'].tolist() if i is not pd.np.nan]))]
-        self.df['identifier_mentions'] = self.df['fulltext'].map(lambda x: find_entities(x, identifiers))
-        self.df['links'] = self.df[['links', 'links2']].apply(lambda x: list(chain.from_iterable(x)), axis=1)
-        self.remove_nan('links')
-        self.df['links'] = self.df['links'].map(lambda x: [l for l in x if "@" not in l]) # filter out email addresses
-        self.df['cites'] = self.df['links'].map(lambda x: [clean_link(l, self.url2title) for l in x])
-        self.df['targets'] = self.df[['cites', 'title_mentions']].apply(lambda x: list(chain.from_iterable(x)), axis=1)
-        self.df['target_links'] = self.df['targets'].map(lambda x: [self.title2url.get(t) for t in x if self.title2url.get(t)])
+        titles, identifiers = get_mentionables(self.df)
+        self.df = preprocess_df(self.df, titles, identifiers, self.url2title, self.title2url)
+
+    def preprocess_chunked(self, name):
+        """Preprocess the corpus in batches and build the graph on the way.
+
+        Titles and identifiers are collected in a first pass over the corpus,
+        every batch is then preprocessed and written to
+        <output>/<name>_parts/part-<n>.pkl, and its edges are added to the graph.
+
+        :param name: name of the analysis
+        :returns: (graph, labels) as in create_graph()
+        """
+        partsfolder = os.path.join(self.output, "%s_parts" %name)
+        # write to a fresh folder, so no parts of a previous run are left over
+        tmpfolder = partsfolder+".tmp"
+        if os.path.exists(tmpfolder):
+            shutil.rmtree(tmpfolder)
+        os.makedirs(tmpfolder)
+        titles, identifiers = collect_mentionables(self.input)
+        B = nx.Graph()
+        labels = {}
+        for i, df in enumerate(iter_chunks(self.input, self.chunksize)):
+            df = preprocess_df(df, titles, identifiers, self.url2title, self.title2url)
+            df.to_pickle(os.path.join(tmpfolder, "part-%05d.pkl" %i))
+            add_edges(B, labels, df)
+        if os.path.exists(partsfolder):
+            shutil.rmtree(partsfolder)
+        os.rename(tmpfolder, partsfolder)
+        return B, labels
 
     def cache_df(self, filename):
         self.df.to_pickle(os.path.join(self.output, "%s.pkl" %filename))
 
     def load_cached_df(self, cached_df):
+        if os.path.isdir(cached_df):
+            return pd.concat(list(iter_parts(cached_df)), ignore_index=True)
         return pd.read_pickle(cached_df)
 
     def get_url2title(self):
@@ -138,17 +280,6 @@ class MassoCorpus(object):
             title2url = {row[1].lower():row[0] for row in csvreader}
         return title2url
 
-    def listify_colum(self, column):
-        selection = self.df[self.df[column].map(lambda x: type(x) == list) == False].index
-        self.df.ix[selection, column] = self.df.ix[selection][column].map(lambda x: [x])
-
-    def unlistify_colum(self, column):
-        selection = self.df[self.df[column].map(lambda x: type(x) == list) == True].index
-        self.df.ix[selection, column] = self.df.ix[selection][column].map(lambda x: " ".join(x))
-
-    def remove_nan(self, column):
-        self.df[column] = self.df[column].map(lambda x: [i for i in x if i is not pd.np.nan])
-
     def get_links(self):
         links = self.df['links'].tolist()
         links = [l for l in links if (l is not pd.np.nan and l is not None)]
@@ -174,29 +305,22 @@ class MassoCorpus(object):
     def create_graph(self):
         B = nx.Graph()
         labels = {}
-        for row in self.df.iterrows():
-            title = (row[1].title)
-            targets = (row[1].targets)
-            source = title
-            targets = [t for t in targets if len(t) > 1]
-            if not source in B.nodes():
-                B.add_node(source, bipartite=0)
-                labels[source] = source
-            for target in targets:
-                if not target in B.nodes():
-                    B.add_node(target, bipartite=1)
-                B.add_edge(source, target)
+        add_edges(B, labels, self.df)
         return B, labels
 
 
-def main(input, output, name, cached_df):
+def main(input, output, name, cached_df, chunksize=None):
     if not os.path.exists(output):
         os.makedirs(output)
-    corpus = MassoCorpus(input, output, cached_df)
+    corpus = MassoCorpus(input, output, cached_df, chunksize)
+    if chunksize and not cached_df:
+        B, labels = corpus.preprocess_chunked(name)
+        export_graph(B, output, name)
+        return
     if not cached_df:
         corpus.preprocess()
     B, labels = corpus.create_graph()
-    nx.write_graphml(B, os.path.join(output, "%s.graphml" %name))
+    export_graph(B, output, name)
     corpus.cache_df(name)
 
 
@@ -205,6 +329,7 @@ if __name__ == '__main__':
     parser.add_argument('--input', dest='input', help='relative or absolute path of the corpus.json')
     parser.add_argument('--output', dest='output', help='relative or absolute path of the results folder')
     parser.add_argument('--name', dest='name', help='name of the analysis')
-    parser.add_argument('--cached_df', dest='cached_df', help='relative or absolute path of the cached_df')
+    parser.add_argument('--cached_df', dest='cached_df', help='relative or absolute path of the cached_df, or of a <name>_parts folder')
+    parser.add_argument('--chunksize', dest='chunksize', type=int, help='number of documents per batch, enables the chunked mode')
     args = parser.parse_args()
-    main(args.input, args.output, args.cached_df)
+    main(args.input, args.output, args.name, args.cached_df, args.chunksize)
@@ -1,6 +1,7 @@
 from crawl import *
 from extract import *
 from analyse import *
+from embed import Embedder
 import pathlib
 import os
 
@@ -60,16 +61,30 @@ def main(args):
 
     if not os.path.exists(output):
         os.makedirs(output)
-    corpus = MassoCorpus(inputfolder, output, cached_df)
-    if not cached_df:
-        corpus.preprocess()
-    print("Creating graph.")
-    B, labels = corpus.create_graph()
-    plot_component_subgraphs(B)
+    corpus = MassoCorpus(inputfolder, output, cached_df, args.chunksize)
+    if args.chunksize:
+        print("Preprocessing in chunks and creating graph.")
+        B, labels = corpus.preprocess_chunked(args.name)
+        print("DataFrame partitions exported.")
+    else:
+        if not cached_df:
+            corpus.preprocess()
+        print("Creating graph.")
+        B, labels = corpus.create_graph()
+    network = DocumentNetwork(B)
+    plot_component_subgraphs(B, output, network)
     print("Network graphs exported.")
-    nx.write_graphml(B, os.path.join(output, "%s.graphml" %args.name))
-    corpus.cache_df(args.name)
-    print("DataFrame exported.")
+    export_graph(B, output, args.name, network)
+    if not args.chunksize:
+        corpus.cache_df(args.name)
+        print("DataFrame exported.")
+
+    ### embedding section
+
+    if args.embed:
+        embedder = Embedder(inputfolder, 'models')
+        embedder.run()
+        print("Word embeddings exported.")
 
 
 if __name__ == '__main__':
@@ -77,5 +92,7 @@ if __name__ == '__main__':
     parser.add_argument('--output', dest='output', help='relative or absolute path of the output files')
     parser.add_argument('--name', dest='name', help='name of the analysis')
     parser.add_argument('--cleanup', dest='cleanup', help='flag to start with tabula rasa', action='store_true')
+    parser.add_argument('--embed', dest='embed', help='flag to train phrase and word2vec models', action='store_true')
+    parser.add_argument('--chunksize', dest='chunksize', type=int, help='number of documents per batch, enables the memory-bounded chunked mode')
     args = parser.parse_args()
     main(args)
@@ -0,0 +1,288 @@
+#!/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Train phrase and word2vec models on the extracted corpus
+
+Usage:
+
+python3 embed.py --input corpus/corpus.json --output models
+"""
+
+
+__author__ = "Christopher Kittel"
+__copyright__ = "Copyright 2016"
+__license__ = "MIT"
+__version__ = "0.0.1"
+__maintainer__ = "Christopher Kittel"
+__email__ = "web@christopherkittel.eu"
+__status__ = "Prototype" # 'Development', 'Production' or 'Prototype'
+
+
+import os
+import glob
+import json
+import argparse
+import logging
+
+from gensim import models
+from nltk.tokenize import sent_tokenize, word_tokenize
+
+FORMAT = '%(asctime)-15s %(message)s'
+logging.basicConfig(format=FORMAT, filename='embed.log', level=logging.INFO)
+logger = logging.getLogger('embedlogger')
+
+
+def setup_folders(foldername):
+    """Check whether outfolder folder and path exist, create them if necessary."""
+    if not os.path.exists(foldername):
+        os.makedirs(foldername)
+
+def clean_fulltext(fulltext):
+    """Join a fulltext to a single string and remove linebreaks left over from extraction."""
+    if isinstance(fulltext, list):
+        fulltext = " ".join(f for f in fulltext if f)
+    fulltext = fulltext.replace('\n  \n', '\n')
+    fulltext = fulltext.replace('\n \n', '\n')
+    fulltext = fulltext.replace('\n\n', '\n')
+    return fulltext.replace('\n', ' ')
+
+
+class CorpusSentences(object):
+    """Stream word-tokenized sentences from a corpus.json, one document at a time.
+
+    Args:
+        corpus (str): relative or absolute path to the corpus.json
+    """
+    def __init__(self, corpus):
+        super(CorpusSentences, self).__init__()
+        self.corpus = corpus
+
+    def __iter__(self):
+        with open(self.corpus, "r") as infile:
+            for line in infile:
+                if not line.strip():
+                    continue
+                fulltext = json.loads(line).get("fulltext")
+                if not fulltext:
+                    continue
+                for sentence in sent_tokenize(clean_fulltext(fulltext)):
+                    yield word_tokenize(sentence)
+
+
+def load_json(filename):
+    """Return the contents of a JSON file, or None if it does not exist."""
+    if not os.path.exists(filename):
+        return None
+    with open(filename, "r") as infile:
+        return json.load(infile)
+
+def save_json(data, filename):
+    """Write a JSON file atomically through a temporary file."""
+    with open(filename+".tmp", "w") as outfile:
+        json.dump(data, outfile)
+    os.rename(filename+".tmp", filename)
+
+def dump_sentences(sentences, filename):
+    """Write sentences as space separated tokens, one sentence per line."""
+    with open(filename, "w") as outfile:
+        for sentence in sentences:
+            outfile.write(" ".join(sentence)+"\n")
+
+
+class Embedder(object):
+    """Train phrases and a skip-gram word2vec model with checkpoints.
+
+    Every stage writes its results to the output folder and is skipped
+    if these already exist for the same corpus.json, word2vec is
+    checkpointed after every epoch.
+    The final vectors are saved normalised and in a form that can be
+    memory-mapped by several processes, see load_vectors().
+
+    Args:
+        input (str): relative or absolute path to the corpus.json
+        output (str): relative or absolute path to the model folder
+        epochs (int): number of word2vec training epochs
+        size (int): dimensionality of the word vectors
+        window (int): word2vec context window
+        min_count (int): minimum frequency for phrases and words
+        workers (int): number of word2vec worker threads
+    """
+    def __init__(self, input, output, epochs=50, size=100, window=5, min_count=3, workers=4):
+        super(Embedder, self).__init__()
+        self.input = input
+        self.output = output
+        self.epochs = epochs
+        self.size = size
+        self.window = window
+        self.min_count = min_count
+        self.workers = workers
+        self.log = logger
+        setup_folders(output)
+        self.sentences_path = os.path.join(output, "sentences.txt")
+        self.stamp_path = os.path.join(output, "sentences.stamp.json")
+        self.phrases_path = os.path.join(output, "phrases.model")
+        self.phrased_path = os.path.join(output, "phrased_sentences.txt")
+        self.checkpoint_prefix = os.path.join(output, "w2v.checkpoint")
+        self.state_path = os.path.join(output, "w2v.state.json")
+        self.vectors_path = os.path.join(output, "w2v.vectors")
+
+    def corpus_stamp(self):
+        """Return path, size and modification time of the input corpus."""
+        stat = os.stat(self.input)
+        return {"input": os.path.abspath(self.input), "size": stat.st_size, "mtime": stat.st_mtime}
+
+    def reset(self):
+        """Remove all intermediate results and checkpoints to start over."""
+        paths = [self.sentences_path, self.stamp_path, self.phrases_path,
+                 self.phrased_path, self.state_path]
+        for filename in paths + glob.glob(self.checkpoint_prefix+".*"):
+            if os.path.exists(filename):
+                os.remove(filename)
+
+    def tokenize(self):
+        """Tokenize the corpus once into a sentence file.
+
+        The sentences are reused only as long as the corpus is unchanged,
+        otherwise all later stages are started over as well.
+        """
+        stamp = self.corpus_stamp()
+        if os.path.exists(self.sentences_path):
+            if load_json(self.stamp_path) == stamp:
+                self.log.info("Reusing %s" %self.sentences_path)
+                return
+            self.log.info("%s has changed, starting over" %self.input)
+            self.reset()
+        dump_sentences(CorpusSentences(self.input), self.sentences_path+".tmp")
+        os.rename(self.sentences_path+".tmp", self.sentences_path)
+        save_json(stamp, self.stamp_path)
+
+    def train_phrases(self):
+        """Learn bigram phrases and write the phrased sentences to disk."""
+        if os.path.exists(self.phrased_path):
+            self.log.info("Reusing %s" %self.phrased_path)
+            return
+        if os.path.exists(self.phrases_path):
+            bigram_transformer = models.Phrases.load(self.phrases_path)
+        else:
+            sentences = models.word2vec.LineSentence(self.sentences_path)
+            bigram_transformer = models.Phrases(sentences, min_count=self.min_count)
+            bigram_transformer.save(self.phrases_path)
+        sentences = models.word2vec.LineSentence(self.sentences_path)
+        dump_sentences((bigram_transformer[s] for s in sentences), self.phrased_path+".tmp")
+        os.rename(self.phrased_path+".tmp", self.phrased_path)
+
+    def load_state(self):
+        return load_json(self.state_path) or {"epoch": 0}
+
+    def save_state(self, state):
+        save_json(state, self.state_path)
+
+    def settings(self):
+        """Return the settings a word2vec checkpoint depends on."""
+        return {"epochs": self.epochs, "size": self.size,
+                "window": self.window, "min_count": self.min_count}
+
+    def remove_checkpoint(self, path):
+        """Remove a checkpoint and the arrays saved next to it."""
+        for filename in glob.glob(path) + glob.glob(path+".*"):
+            os.remove(filename)
+
+    def train_word2vec(self):
+        """Train word2vec epoch by epoch, resuming from the last checkpoint.
+
+        Every epoch is saved to its own checkpoint file before the state
+        file is pointed at it, so an interrupted save never replaces the
+        last complete checkpoint.
+        """
+        sentences = models.word2vec.LineSentence(self.phrased_path)
+        state = self.load_state()
+        if state.get("epoch") > 0 and state.get("corpus") != self.corpus_stamp():
+            self.log.info("Checkpoint was trained on another corpus, starting over")
+            if state.get("checkpoint"):
+                self.remove_checkpoint(state.get("checkpoint"))
+            state = {"epoch": 0}
+        if state.get("epoch") > 0:
+            if state.get("settings") != self.settings():
+                raise ValueError("Checkpoint in %s was trained with %s, not %s; remove %s to start over"
+                                 %(self.output, state.get("settings"), self.settings(), self.state_path))
+            model = models.Word2Vec.load(state.get("checkpoint"))
+            self.log.info("Resuming word2vec after epoch %d" %state.get("epoch"))
+        else:
+            model = models.Word2Vec(size=self.size, window=self.window, min_count=self.min_count,
+                                    workers=self.workers, sg=1)
+            model.build_vocab(sentences)
+        # one pass per train() call, the learning rate decays linearly over all epochs
+        model.iter = 1
+        alpha, min_alpha = 0.025, 0.0001
+        decay = (alpha - min_alpha) / self.epochs
+        for epoch in range(state.get("epoch"), self.epochs):
+            model.alpha = alpha - decay * epoch
+            model.min_alpha = alpha - decay * (epoch + 1)
+            model.train(sentences, total_examples=model.corpus_count)
+            checkpoint = "%s.%d" %(self.checkpoint_prefix, epoch + 1)
+            model.save(checkpoint)
+            previous = state.get("checkpoint")
+            state = {"epoch": epoch + 1, "checkpoint": checkpoint,
+                     "settings": self.settings(), "corpus": self.corpus_stamp()}
+            self.save_state(state)
+            if previous:
+                self.remove_checkpoint(previous)
+            self.log.info("Finished word2vec epoch %d" %(epoch + 1))
+        return model
+
+    def export_vectors(self, model):
+        """Save the normalised vectors as separate arrays for memory-mapping.
+
+        The exported model is query-only, the training weights are dropped
+        so that loading it does not unpickle a private copy of them.
+        """
+        model.init_sims(replace=True)
+        for attr in ['syn1', 'syn1neg', 'syn0_lockf']:
+            if hasattr(model, attr):
+                delattr(model, attr)
+        model.save(self.vectors_path, separately=['syn0'])
+
+    def run(self):
+        self.tokenize()
+        self.train_phrases()
+        model = self.train_word2vec()
+        self.export_vectors(model)
+        return model
+
+
+def load_vectors(path):
+    """Load vectors saved by Embedder.export_vectors() memory-mapped.
+
+    The vectors are opened read-only, so several processes share the
+    same pages. They are already normalised, syn0norm is pointed at them
+    to skip the normalisation on the first query.
+
+    :param path: path of the w2v.vectors file
+    :returns: gensim.models.Word2Vec
+    """
+    model = models.Word2Vec.load(path, mmap='r')
+    model.syn0norm = model.syn0
+    return model
+
+
+def main(args):
+    embedder = Embedder(args.input, args.output, args.epochs, args.size, args.window, args.min_count, args.workers)
+    embedder.run()
+    if args.query:
+        model = load_vectors(embedder.vectors_path)
+        for word, score in model.most_similar_cosmul(positive=args.query.split(","), topn=20):
+            print("%s\t%.4f" %(word, score))
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Train phrase and word2vec models on the extracted corpus.')
+    parser.add_argument('--input', dest='input', help='relative or absolute path of the corpus.json')
+    parser.add_argument('--output', dest='output', help='relative or absolute path of the model folder')
+    parser.add_argument('--epochs', dest='epochs', type=int, default=50, help='number of word2vec training epochs')
+    parser.add_argument('--size', dest='size', type=int, default=100, help='dimensionality of the word vectors')
+    parser.add_argument('--window', dest='window', type=int, default=5, help='word2vec context window')
+    parser.add_argument('--min_count', dest='min_count', type=int, default=3, help='minimum frequency of phrases and words')
+    parser.add_argument('--workers', dest='workers', type=int, default=4, help='number of word2vec worker threads')
+    parser.add_argument('--query', dest='query', help='comma-separated words to query most_similar_cosmul, e.g. "open_science"')
+    args = parser.parse_args()
+    main(args)
@@ -28,9 +28,17 @@ import logging
 import time
 import json
 import csv
+import io
+import subprocess
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
 
 from lxml import html, etree
 import textract
+from pdfminer.pdfinterp import PDFResourceManager, PDFPageInterpreter
+from pdfminer.converter import TextConverter
+from pdfminer.layout import LAParams
+from pdfminer.pdfpage import PDFPage
 
 FORMAT = '%(asctime)-15s %(message)s'
 logging.basicConfig(format=FORMAT, filename='extract.log', level=logging.INFO)
@@ -62,6 +70,94 @@ def setup_folders(foldername):
     if not os.path.exists(foldername):
         os.makedirs(foldername)
 
+PDF_BACKENDS = ["pdftotext", "pdfminer"]
+
+
+def count_pages(pdffile):
+    """Return the number of pages of a PDF, as reported by pdfinfo."""
+    info = subprocess.check_output(["pdfinfo", pdffile]).decode('utf-8', 'ignore')
+    for line in info.splitlines():
+        if line.startswith("Pages:"):
+            return int(line.split(":")[1])
+    raise ValueError("No page count found for %s" %pdffile)
+
+def page_ranges(n_pages, chunksize):
+    """Split n_pages into consecutive (first, last) ranges, 1-indexed and inclusive."""
+    return [(first, min(first + chunksize - 1, n_pages))
+            for first in range(1, n_pages + 1, chunksize)]
+
+def extract_pages_pdftotext(pdffile, pagenos):
+    """Extract the text layer of single pages with pdftotext.
+
+    This is very fast, but returns no text for scanned pages.
+
+    :param pdffile: path to a PDF file
+    :param pagenos: 1-indexed page numbers
+    :returns: generator of (pageno, text, seconds)
+    """
+    for pageno in pagenos:
+        start = time.time()
+        cmd = ["pdftotext", "-layout", "-enc", "UTF-8",
+               "-f", str(pageno), "-l", str(pageno), pdffile, "-"]
+        try:
+            text = subprocess.check_output(cmd, stderr=subprocess.DEVNULL).decode('utf-8', 'ignore')
+        except Exception:
+            text = ""
+        yield pageno, text, time.time() - start
+
+def extract_pages_pdfminer(pdffile, pagenos):
+    """Extract the text of several pages with pdfminer, parsing the PDF once.
+
+    :param pdffile: path to a PDF file
+    :param pagenos: 1-indexed page numbers
+    :returns: generator of (pageno, text, seconds)
+    """
+    pagenos = sorted(pagenos)
+    rsrcmgr = PDFResourceManager()
+    laparams = LAParams()
+    with open(pdffile, "rb") as fp:
+        # PDFPage.get_pages() takes 0-indexed page numbers and yields them in order
+        pages = PDFPage.get_pages(fp, pagenos=set(p - 1 for p in pagenos))
+        for pageno, page in zip(pagenos, pages):
+            start = time.time()
+            output = io.BytesIO()
+            device = TextConverter(rsrcmgr, output, codec='utf-8', laparams=laparams)
+            try:
+                PDFPageInterpreter(rsrcmgr, device).process_page(page)
+                text = output.getvalue().decode('utf-8', 'ignore')
+            except Exception:
+                text = ""
+            finally:
+                device.close()
+            yield pageno, text, time.time() - start
+
+PDF_EXTRACTORS = {"pdftotext": extract_pages_pdftotext,
+                  "pdfminer": extract_pages_pdfminer}
+
+def extract_page_range(pdffile, first, last, backends):
+    """Extract the pages first..last of a PDF.
+
+    The backends are tried in order, every backend only gets the pages
+    for which the previous ones failed or returned no text.
+
+    :returns: list of dictionaries with page, text, backend and seconds
+    """
+    pages = {pageno: {"page": pageno, "text": "", "backend": None, "seconds": 0.0}
+             for pageno in range(first, last + 1)}
+    for backend in backends:
+        missing = [pageno for pageno in sorted(pages) if pages[pageno]["backend"] is None]
+        if not missing:
+            break
+        try:
+            for pageno, text, seconds in PDF_EXTRACTORS[backend](pdffile, missing):
+                pages[pageno]["seconds"] += seconds
+                if text.strip():
+                    pages[pageno]["text"] = text
+                    pages[pageno]["backend"] = backend
+        except Exception:
+            continue
+    return [pages[pageno] for pageno in sorted(pages)]
+
 class Extractor(object):
     """Extract fulltext and metadata from different formats.
 
@@ -71,8 +167,12 @@ class Extractor(object):
         convert (str): type of the conversion, one of ["xml", "html", "pdf"]
         stylesheets_path (str): relative or absolute path of the stylesheets definitions
         classification (str): classification of the documents, one of ["press", "call", "pdf"]
+        pdf_backends (list): PDF backends to try per page, in order of preference
+        page_chunk (int): number of PDF pages processed per parallel job
+        workers (int): number of parallel processes for PDF extraction
     """
-    def __init__(self, input, output, convert, stylesheets_path, classification):
+    def __init__(self, input, output, convert, stylesheets_path, classification,
+                 pdf_backends=None, page_chunk=10, workers=None):
         super(Extractor, self).__init__()
         self.input = input
         self.output = output
@@ -80,6 +180,12 @@ class Extractor(object):
         self.raws = os.listdir(self.input)
         self.classification = classification
         self.log = logger
+        self.pdf_backends = pdf_backends or PDF_BACKENDS
+        for backend in self.pdf_backends:
+            if backend not in PDF_EXTRACTORS:
+                raise ValueError("Unknown PDF backend %s, use one of %s" %(backend, PDF_BACKENDS))
+        self.page_chunk = page_chunk
+        self.workers = workers
         setup_folders(output)
         if stylesheets_path:
             self.stylesheets_path = stylesheets_path
@@ -155,24 +261,77 @@ class Extractor(object):
         results["classification"] = self.classification
         return results
 
-    def extractFromPDF(self, pdffile):
+    def extractFromPDF(self, pdffile, executor=None):
         """Extract fulltext and metadata from a PDF file.
 
+        The PDF is split into ranges of self.page_chunk pages, which are
+        extracted in parallel if an executor is given. Each page is extracted
+        with the first of self.pdf_backends that yields text. Finished pages
+        are streamed to <docname>.pages.json in the output folder.
+        If the page count cannot be determined, the whole document is
+        handed to textract.process(), building on pdfminer.
+
+        :param pdffile: path to a PDF file
+        :param executor: optional concurrent.futures executor for the page ranges
+        :returns: dictionary
+        """
+        results = {}
+        _ , tail = os.path.split(pdffile)
+        docname, _ = os.path.splitext(tail)
+        try:
+            n_pages = count_pages(pdffile)
+        except Exception:
+            self.log.error("Could not count pages of %s, falling back to textract" %docname)
+            return self.extractFromPDFWhole(pdffile)
+        ranges = page_ranges(n_pages, self.page_chunk)
+        if executor:
+            jobs = [executor.submit(extract_page_range, pdffile, first, last, self.pdf_backends)
+                    for first, last in ranges]
+            chunks = (job.result() for job in as_completed(jobs))
+        else:
+            chunks = (extract_page_range(pdffile, first, last, self.pdf_backends)
+                      for first, last in ranges)
+        pages = []
+        with open(os.path.join(self.output, docname+".pages.json"), "w") as outfile:
+            for chunk in chunks:
+                for page in chunk:
+                    outfile.write(json.dumps(page)+"\n")
+                outfile.flush()
+                pages.extend(chunk)
+        pages = sorted(pages, key=lambda p: p.get("page"))
+        failed = [p.get("page") for p in pages if p.get("backend") is None]
+        if failed:
+            self.log.error("No text found on pages %s of %s" %(failed, docname))
+        results["fulltext"] = "\n".join(p.get("text") for p in pages)
+        results["page_backends"] = [p.get("backend") for p in pages]
+        results["page_seconds"] = [round(p.get("seconds"), 4) for p in pages]
+        results["title"] = docname
+        results["local_source"] = pdffile
+        results["classification"] = self.classification
+        return results
+
+    def extractFromPDFWhole(self, pdffile):
+        """Extract fulltext and metadata from a PDF file as one unit.
+
         This function applies textract.process(), building on pdfminer,
-        to extract the text content from a PDF.
+        to extract the text content from a PDF. As there are no per-page
+        results, the backend and time are recorded for the whole document
+        in pdf_backend and seconds.
 
-        :param tree: path to a PDF file
-        :param type: str
+        :param pdffile: path to a PDF file
         :returns: dictionary
         """
         results = {}
         _ , tail = os.path.split(pdffile)
         docname, _ = os.path.splitext(tail)
+        start = time.time()
         try:
             results["fulltext"] = textract.process(pdffile, method='pdfminer', encoding='utf-8').decode('utf-8')
         except Exception:
             self.log.error("Could not process %s" %docname)
             return
+        results["pdf_backend"] = "textract"
+        results["seconds"] = round(time.time() - start, 4)
         results["title"] = docname
         results["local_source"] = pdffile
         results["classification"] = self.classification
@@ -189,14 +348,26 @@ class Extractor(object):
             self.html2json()
 
     def pdf2json(self):
-        for raw in self.raws:
-            results = self.extractFromPDF(os.path.join(self.input, raw))
-            try:
-                with open(os.path.join(self.output, results.get("title")+".json"), "w") as outfile:
-                    json.dump(results, outfile)
-                self.dump_to_corpus(results)
-            except Exception:
-                self.log.error("Could not process %s" %raw)
+        executor = ProcessPoolExecutor(max_workers=self.workers)
+        try:
+            for raw in self.raws:
+                pdffile = os.path.join(self.input, raw)
+                try:
+                    try:
+                        results = self.extractFromPDF(pdffile, executor)
+                    except BrokenProcessPool:
+                        # a crashed worker breaks the pool for all following documents
+                        self.log.error("Worker crashed on %s, falling back to textract" %raw)
+                        executor.shutdown(wait=False)
+                        executor = ProcessPoolExecutor(max_workers=self.workers)
+                        results = self.extractFromPDFWhole(pdffile)
+                    with open(os.path.join(self.output, results.get("title")+".json"), "w") as outfile:
+                        json.dump(results, outfile)
+                    self.dump_to_corpus(results)
+                except Exception:
+                    self.log.error("Could not process %s" %raw)
+        finally:
+            executor.shutdown()
 
     def xml2json(self):
         for raw in self.raws:
@@ -222,7 +393,9 @@ class Extractor(object):
                 self.log.error("Could not dump %s" %results.get('title'))
 
 def main(args):
-    extractor = Extractor(args.input, args.output, args.convert, args.stylesheets_path, args.classification)
+    pdf_backends = args.pdf_backends.split(",") if args.pdf_backends else None
+    extractor = Extractor(args.input, args.output, args.convert, args.stylesheets_path, args.classification,
+                          pdf_backends, args.page_chunk, args.workers)
     extractor.convert_files()
 
 if __name__ == '__main__':
@@ -232,5 +405,8 @@ if __name__ == '__main__':
     parser.add_argument('--convert', dest='convert', help='type of the conversion, one of ["xml", "html", "pdf"]')
     parser.add_argument('--stylesheets_path', dest='stylesheets_path', help='relative or absolute path of the stylesheets definitions')
     parser.add_argument('--classification', dest='classification', help='classification of the documents, one of ["press", "call"]')
+    parser.add_argument('--pdf_backends', dest='pdf_backends', help='comma-separated PDF backends to try per page, default "pdftotext,pdfminer"')
+    parser.add_argument('--page_chunk', dest='page_chunk', type=int, default=10, help='number of PDF pages per parallel job')
+    parser.add_argument('--workers', dest='workers', type=int, help='number of parallel processes for PDF extraction')
     args = parser.parse_args()
     main(args)
@@ -0,0 +1,186 @@
+#!/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Sparse-matrix analytics for the document network
+
+"""
+
+
+__author__ = "Christopher Kittel"
+__copyright__ = "Copyright 2016"
+__license__ = "MIT"
+__version__ = "0.0.1"
+__maintainer__ = "Christopher Kittel"
+__email__ = "web@christopherkittel.eu"
+__status__ = "Prototype" # 'Development', 'Production' or 'Prototype'
+
+
+import numpy as np
+import networkx as nx
+from scipy import sparse
+from scipy.sparse import csgraph
+
+
+class DocumentNetwork(object):
+    """Analyse the bipartite document graph as a sparse adjacency matrix.
+
+    The graph is converted once; all measures are computed with sparse
+    linear algebra on the adjacency matrix.
+
+    Args:
+        B (networkx.Graph): document graph as returned by MassoCorpus.create_graph()
+    """
+    def __init__(self, B):
+        super(DocumentNetwork, self).__init__()
+        self.B = B
+        nodes = list(B.nodes(data=True))
+        self.nodes = [n for n, _ in nodes]
+        self.index = {n:i for i, n in enumerate(self.nodes)}
+        self.documents = np.array([attrs.get("bipartite") == 0 for _, attrs in nodes], dtype=bool)
+        self.A = self.to_sparse()
+
+    def to_sparse(self):
+        """Return the symmetric adjacency matrix of the graph in CSR format."""
+        rows, cols, data = [], [], []
+        for u, v, attrs in self.B.edges(data=True):
+            i, j = self.index[u], self.index[v]
+            weight = attrs.get("weight", 1)
+            rows.append(i)
+            cols.append(j)
+            data.append(weight)
+            if i != j:
+                rows.append(j)
+                cols.append(i)
+                data.append(weight)
+        n = len(self.nodes)
+        A = sparse.coo_matrix((data, (rows, cols)), shape=(n, n), dtype=np.float64)
+        return A.tocsr()
+
+    def components(self):
+        """Return the connected components as lists of nodes, largest first."""
+        n_components, labels = csgraph.connected_components(self.A, directed=False)
+        members = [[] for _ in range(n_components)]
+        for i, label in enumerate(labels):
+            members[label].append(self.nodes[i])
+        return sorted(members, key=len, reverse=True)
+
+    def _degrees(self, A=None):
+        # self loops count twice, as in networkx
+        if A is None:
+            A = self.A
+        return np.diff(A.indptr) + (A.diagonal() != 0)
+
+    def degree(self):
+        """Return a dictionary of unweighted node degrees."""
+        return dict(zip(self.nodes, self._degrees().tolist()))
+
+    def degree_centrality(self, nodes=None):
+        """Return the degree centrality, normalised by n-1 as in networkx.
+
+        :param nodes: optional subset of nodes, e.g. a component; degrees
+            are then taken in the subgraph induced by these nodes
+        :returns: dictionary
+        """
+        if nodes is None:
+            nodes = self.nodes
+            degrees = self._degrees()
+        else:
+            idx = [self.index[n] for n in nodes]
+            degrees = self._degrees(self.A[idx][:, idx])
+        degrees = degrees.astype(np.float64)
+        if len(nodes) > 1:
+            degrees = degrees / (len(nodes) - 1)
+        else:
+            degrees = np.ones(len(nodes))
+        return dict(zip(nodes, degrees.tolist()))
+
+    def pagerank(self, alpha=0.85, max_iter=100, tol=1.0e-6):
+        """Return the PageRank of all nodes, computed by power iteration.
+
+        Dangling nodes distribute their rank uniformly, as in nx.pagerank.
+        """
+        n = len(self.nodes)
+        if n == 0:
+            return {}
+        out_degree = np.asarray(self.A.sum(axis=1)).ravel()
+        dangling = out_degree == 0
+        inv_degree = np.zeros(n)
+        inv_degree[~dangling] = 1.0 / out_degree[~dangling]
+        # column-stochastic transition matrix
+        M = (sparse.diags(inv_degree) * self.A).T.tocsr()
+        x = np.ones(n) / n
+        for _ in range(max_iter):
+            x_last = x
+            x = alpha * (M * x_last + x_last[dangling].sum() / n) + (1 - alpha) / n
+            if np.abs(x - x_last).sum() < n * tol:
+                break
+        return dict(zip(self.nodes, x.tolist()))
+
+    def document_projection(self):
+        """Project the graph onto the documents (bipartite=0).
+
+        Two documents are linked if they share a neighbour, the weight is
+        the number of shared neighbours.
+
+        :returns: (list of documents, sparse document-document matrix)
+        """
+        X = self.A[self.documents]
+        P = (X * X.T).tocsr()
+        P.setdiag(0)
+        P.eliminate_zeros()
+        documents = [n for n, d in zip(self.nodes, self.documents) if d]
+        return documents, P
+
+    def projected_graph(self):
+        """Return the document projection as a weighted networkx graph."""
+        documents, P = self.document_projection()
+        P = sparse.triu(P).tocoo()
+        G = nx.Graph()
+        G.add_nodes_from(documents)
+        G.add_weighted_edges_from((documents[i], documents[j], float(w))
+                                  for i, j, w in zip(P.row, P.col, P.data))
+        return G
+
+    def write_edgelist(self, filename):
+        """Write the graph as a compressed binary edge list (.npz).
+
+        Every edge is stored once as a pair of node indices with its weight,
+        next to the node labels and their bipartite set.
+        """
+        save_edgelist(filename, self.A, self.nodes, self.documents)
+
+    def write_projection(self, filename):
+        """Write the document projection in the binary edge list format.
+
+        It can be read back with read_edgelist(), all nodes are documents.
+        """
+        documents, P = self.document_projection()
+        save_edgelist(filename, P, documents, np.ones(len(documents), dtype=bool))
+
+
+def save_edgelist(filename, A, nodes, documents):
+    """Save the upper triangle of a symmetric adjacency matrix as compressed .npz."""
+    U = sparse.triu(A).tocoo()
+    np.savez_compressed(filename,
+                        source=U.row.astype(np.int32),
+                        target=U.col.astype(np.int32),
+                        weight=U.data.astype(np.float32),
+                        nodes=np.array(nodes, dtype=str),
+                        documents=documents)
+
+
+def read_edgelist(filename):
+    """Read a binary edge list written by DocumentNetwork.write_edgelist()
+    or DocumentNetwork.write_projection().
+
+    :returns: networkx.Graph
+    """
+    B = nx.Graph()
+    with np.load(filename) as data:
+        nodes = data["nodes"].tolist()
+        for node, document in zip(nodes, data["documents"]):
+            B.add_node(node, bipartite=0 if document else 1)
+        B.add_weighted_edges_from((nodes[s], nodes[t], float(w)) for s, t, w
+                                  in zip(data["source"], data["target"], data["weight"]))
+    return B